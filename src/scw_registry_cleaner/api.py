@@ -5,20 +5,29 @@ from __future__ import annotations
 import logging
 import platform
 import pprint
+import random
 import sys
+import warnings
 from collections import defaultdict
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from enum import Enum
-from itertools import islice
-from typing import TYPE_CHECKING, Self, TypeVar
+from heapq import nsmallest
+from math import ceil
+from operator import attrgetter
+from typing import TYPE_CHECKING, Self
 
 import anyio
-from anyio import Lock, create_task_group
+import msgspec
+from anyio import Lock, Semaphore, create_memory_object_stream, create_task_group
 from httpx import (
+    URL,
     AsyncClient,
     AsyncHTTPTransport,
-    HTTPStatusError,
+    HTTPError,
+    Limits,
+    ReadError,
+    RemoteProtocolError,
     Request,
     Response,
     Timeout,
@@ -27,16 +36,19 @@ from httpx import (
 import scw_registry_cleaner
 
 if TYPE_CHECKING:
-    from collections.abc import Generator, Iterable
+    from collections.abc import AsyncGenerator, Hashable, Iterable
     from re import Pattern
     from typing import Any
 
-__all__ = ["ImageRef", "RegistryAPI", "TagStatus"]
+    from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
 
-BatchedT = TypeVar("BatchedT")
+__all__ = ["ImageRef", "RegistryAPI", "Tag", "TagStatus"]
 
 logger = logging.getLogger(__name__)
 
+# Maximum page size accepted by the registry API on list endpoints
+PAGE_SIZE = 100
+
 REGIONS = {
     "fr-par": {
         "url": "https://api.scaleway.com/registry/v1/regions/fr-par",
@@ -50,18 +62,6 @@ REGIONS = {
 }
 
 
-def batched(
-    iterable: Iterable[BatchedT], batch_size: int
-) -> Generator[tuple[BatchedT, ...], Any, None]:
-    "Batch data into tuples of length n. The last batch may be shorter."
-    # batched('ABCDEFG', 3) --> ABC DEF G
-    if batch_size < 1:
-        raise ValueError("batch size must be at least one")
-    iterator = iter(iterable)
-    while batch := tuple(islice(iterator, batch_size)):
-        yield batch
-
-
 class TagStatus(Enum):
     """Image tag status."""
 
@@ -72,7 +72,32 @@ class TagStatus(Enum):
     LOCKED = "locked"
 
 
-@dataclass(frozen=True)
+class Tag(msgspec.Struct, frozen=True):
+    """Tag API object."""
+
+    id: str
+    name: str
+    created_at: datetime
+    status: TagStatus
+
+
+class _TagPage(msgspec.Struct):
+    """Tag listing API response."""
+
+    tags: list[Tag]
+    total_count: int | None = None
+
+
+# Decode tag pages straight into typed objects, skipping intermediate dicts
+_TAG_PAGE_DECODER = msgspec.json.Decoder(_TagPage)
+
+
+def _json(resp: Response) -> Any:
+    """Decode a JSON response body using msgspec."""
+    return msgspec.json.decode(resp.content)
+
+
+@dataclass(frozen=True, slots=True)
 class ImageRef:
     """Represent image reference in the registry."""
 
@@ -88,31 +113,99 @@ class ImageRef:
         """Return a fully qualified image reference."""
         return f"{self.namespace}/{self.image_name}:{self.tag_name}"
 
-    def age(self) -> tuple[int, int]:
+    def age(self, now: datetime | None = None) -> tuple[int, int]:
         """Return image age in days and hours
 
+        Args:
+            now: Reference time to compute the age from. Defaults to the
+                current time.
+
         Returns:
             A tuple of integers
         """
-        delta = datetime.now() - self.created_at
+        delta = (now or datetime.now(timezone.utc)) - self.created_at
         hours, _ = divmod(delta.seconds, 3600)
         return delta.days, hours
 
 
+class _LazyJson:
+    """Pretty format a JSON response body only when the log record is emitted."""
+
+    __slots__ = ("response",)
+
+    def __init__(self, response: Response) -> None:
+        self.response = response
+
+    def __str__(self) -> str:
+        try:
+            return pprint.pformat(self.response.json())
+        except ValueError:
+            return self.response.text
+
+
 class _CustomTransport(AsyncHTTPTransport):
     # Maximum number of times we try to make a request against an API in
     # maintenance before aborting.
     MAX_RETRIES = 3
+    # Rate limited or maintenance HTTP status codes
+    RETRY_STATUS_CODES = (429, 502, 503, 504)
+    # Maximum number of seconds to wait before retrying a request
+    MAX_RETRY_DELAY = 30
 
-    def __init__(self, debug: bool, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-        self.logging = debug
-
-    def retry_in(self, retry):
+    def retry_in(self, retry: int, response: Response | None = None) -> float:
         """If the API returns a maintenance HTTP status code, sleep a while
         before retrying.
+
+        A jittered exponential backoff prevents concurrent requests from
+        retrying all at once. The delay is never shorter than the one
+        advertised by the `Retry-After` header, nor longer than
+        `MAX_RETRY_DELAY`.
+        """
+        retry_in = random.uniform(0.5, min(2**retry, self.MAX_RETRY_DELAY))
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                retry_in = max(retry_in, float(retry_after))
+        return min(retry_in, self.MAX_RETRY_DELAY)
+
+    def _can_retry(self, retry: int, reason: str) -> bool:
+        """Check whether a failed request can be retried.
+
+        Args:
+            retry: Retry number, starting at 1
+            reason: Failure reason, for logging
+
+        Returns:
+            False if the request must not be retried anymore
+        """
+        if retry >= self.MAX_RETRIES:
+            logger.error(
+                "API request still failing (%s) after %s attempts. Stop trying.",
+                reason,
+                self.MAX_RETRIES,
+            )
+            return False
+        return True
+
+    async def _wait_before_retry(
+        self, retry: int, reason: str, response: Response | None = None
+    ) -> None:
+        """Sleep before retrying a failed request.
+
+        Args:
+            retry: Retry number, starting at 1
+            reason: Failure reason, for logging
+            response: The failed response, if any. Defaults to None.
         """
-        return min(2**retry, 30)
+        retry_in = self.retry_in(retry, response)
+        logger.info(
+            "API request failed (%s). Try again in %.1f seconds... (retry %s on %s)",
+            reason,
+            retry_in,
+            retry,
+            self.MAX_RETRIES,
+        )
+        await anyio.sleep(retry_in)
 
     async def handle_async_request(self, request: Request) -> Response:
         retry = 0
@@ -120,44 +213,55 @@ class _CustomTransport(AsyncHTTPTransport):
         while True:
             try:
                 resp = await super().handle_async_request(request)
-                if self.logging:
-                    pprint.pprint(resp.json())
-                return resp
-            except HTTPStatusError as exc:
-                # Not a maintenance exception
-                if exc.response.status_code not in (502, 503, 504):
+            except (ReadError, RemoteProtocolError) as exc:
+                # Transient network error
+                retry += 1
+                reason = type(exc).__name__
+                if not self._can_retry(retry, reason):
                     raise
+                await self._wait_before_retry(retry, reason)
+                continue
 
+            # Transports return error responses instead of raising, check the
+            # status code to detect rate limiting or maintenance.
+            if resp.status_code in self.RETRY_STATUS_CODES:
                 retry += 1
-                retry_in = self.retry_in(retry)
-
-                if retry >= self.MAX_RETRIES:
-                    logger.error(
-                        (
-                            "API endpoint still in maintenance after"
-                            " %s attempts. Stop trying."
-                        ),
-                        self.MAX_RETRIES,
-                    )
-                    raise
+                reason = f"HTTP {resp.status_code}"
+                if self._can_retry(retry, reason):
+                    # Release the connection while waiting
+                    await resp.aclose()
+                    await self._wait_before_retry(retry, reason, resp)
+                    continue
 
-                logger.info(
-                    (
-                        "API endpoint is currently in maintenance. Try again in "
-                        "%s seconds... (retry %s on %s)"
-                    ),
-                    retry_in,
-                    retry,
-                    self.MAX_RETRIES,
-                )
-                await anyio.sleep(retry_in)
+            return resp
 
 
-class RegistryAPI:
+async def _log_response(response: Response) -> None:
+    """Client response hook logging API responses on the DEBUG level.
+
+    Args:
+        response: Response returned by the API
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        await response.aread()
+        logger.debug(
+            "%s %s response:\n%s",
+            response.request.method,
+            response.request.url,
+            _LazyJson(response),
+        )
+
+
+class RegistryAPI:  # pylint: disable=too-many-instance-attributes
     """The default region is par1 as it was the first availability zone
     provided by Scaleway, but it could change in the future.
     """
 
+    # Maximum number of requests sent concurrently to the API
+    MAX_CONCURRENT_REQUESTS = 64
+    # Maximum number of images whose tags are fetched concurrently
+    MAX_CONCURRENT_IMAGES = 32
+
     base_url = None
     user_agent = (
         f"scw-sdk/{scw_registry_cleaner.__version__}"
@@ -171,8 +275,16 @@ class RegistryAPI:
         user_agent: str | None = None,
         region: str | None = None,
         base_url: str | None = None,
-        debug: bool = False,
+        debug: bool | None = None,
     ):
+        if debug is not None:
+            warnings.warn(
+                "The debug argument is deprecated and ignored, set the"
+                " scw_registry_cleaner logger level to DEBUG instead",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+
         if base_url:
             self.base_url = base_url
 
@@ -191,8 +303,17 @@ class RegistryAPI:
             self.user_agent = user_agent
 
         self.base_url = REGIONS[self.region]["url"]
+        self._namespaces_url = f"{self.base_url}/namespaces"
+        self._images_url = f"{self.base_url}/images"
+        self._tags_url = f"{self.base_url}/tags"
         self._read_timout: float = 20.0
-        self.client = self._make_client(debug)
+        self._limiter = Semaphore(self.MAX_CONCURRENT_REQUESTS)
+        self._images_limiter = Semaphore(self.MAX_CONCURRENT_IMAGES)
+        self._namespaces_cache: dict[str, list[dict]] = {}
+        self._images_cache: dict[tuple[str, str | None], list[dict]] = {}
+        # Prevent concurrent calls from fetching the same cache entry twice
+        self._cache_locks: defaultdict[Hashable, Lock] = defaultdict(Lock)
+        self.client = self._make_client()
 
     async def __aenter__(self) -> Self:
         return self
@@ -200,18 +321,28 @@ class RegistryAPI:
     async def __aexit__(self, *_: Any) -> None:
         await self.client.aclose()
 
-    def _make_client(self, debug: bool) -> AsyncClient:
+    def _make_client(self) -> AsyncClient:
         """Create the httpx client.
 
-        Args:
-            logging: Enable logging on the HTTP transport
+        Responses are logged on the DEBUG level.
 
         Returns:
             AN AsyncClient instance
         """
+        # Limits must be set on the mounted transport, client level ones
+        # only apply to the default transport.
+        transport = _CustomTransport(
+            http2=True,
+            limits=Limits(
+                max_connections=self.MAX_CONCURRENT_REQUESTS,
+                max_keepalive_connections=self.MAX_CONCURRENT_REQUESTS // 2,
+                keepalive_expiry=30,
+            ),
+        )
         client = AsyncClient(
-            mounts={"https://": _CustomTransport(debug=debug)},
+            mounts={"https://": transport},
             timeout=Timeout(5.0, read=self._read_timout),
+            event_hooks={"response": [_log_response]},
         )
 
         client.headers.update({"User-Agent": self.user_agent})
@@ -224,129 +355,252 @@ class RegistryAPI:
         return client
 
     @classmethod
-    def to_image_ref(cls, namespace: str, image: dict, tag: dict) -> ImageRef:
+    def to_image_ref(cls, namespace: str, image: dict, tag: Tag) -> ImageRef:
         """Build an ImageRef from image and tag.
 
         Args:
             namespace: Registry namespace
             image: Image API object
-            data: Tag API object
+            tag: Tag API object
 
         Returns:
             An ImageRef instance
         """
-        created_at_dt = datetime.fromisoformat(tag["created_at"].replace("Z", ""))
         return ImageRef(
-            tag_id=tag["id"],
-            tag_name=tag["name"],
-            created_at=created_at_dt,
-            status=TagStatus(tag["status"]),
+            tag_id=tag.id,
+            tag_name=tag.name,
+            created_at=tag.created_at,
+            status=tag.status,
             image_name=image["name"],
             namespace=namespace,
         )
 
     async def _task_get_tags(
         self,
-        lock: Lock,
-        shared_tags: dict[str, list[ImageRef]],
+        send_stream: MemoryObjectSendStream[tuple[str, list[ImageRef]]],
         namespace: str,
         image: dict,
     ) -> None:
-        """An async task that filter image tags based on provided pattern
+        """An async task that sends image tags to send_stream
+
+        Image tags are gathered locally and sent once, as an
+        `(image name, ImageRef list)` tuple.
 
         Args:
-            lock: Anyio lock to prevent concurrent access to shared_tags
-            shared_tags: Shared dictionary on which matching tags will be added
+            send_stream: Stream on which image tags will be sent. It is closed
+                when the task completes.
             namespace: Registry namespace
             image: Namespace image
-            pattern: Pattern to search for
         """
-        tags = await self.get_image_tags(image["id"])
-        for tag in tags:
-            tag = self.to_image_ref(namespace, image, tag)
-            async with lock:
-                shared_tags[image["name"]].append(tag)
-
-    async def get_namespace(self, name: str) -> dict:
+        async with send_stream, self._images_limiter:
+            to_image_ref = self.to_image_ref
+            image_refs = [
+                to_image_ref(namespace, image, tag)
+                async for page_tags in self._get_image_tag_pages(image["id"])
+                for tag in page_tags
+            ]
+            await send_stream.send((image["name"], image_refs))
+
+    async def get_namespace(self, name: str) -> list[dict]:
         """Get a registry namespace
 
+        The response is cached for the lifetime of the instance.
+
         Args:
             name: Namespace name.
 
         Returns:
             Scaleway API response
+
+        Raises:
+            HTTPStatusError: The API returned an error
         """
-        resp = await self.client.get(
-            f"{self.base_url}/namespaces", params={"name": name}
-        )
-        return resp.json()["namespaces"]
+        async with self._cache_locks[("namespace", name)]:
+            if name not in self._namespaces_cache:
+                async with self._limiter:
+                    resp = await self.client.get(
+                        self._namespaces_url, params={"name": name}
+                    )
+                resp.raise_for_status()
+                self._namespaces_cache[name] = _json(resp)["namespaces"]
+        return self._namespaces_cache[name]
 
-    async def get_images(self, namespace_id: str, name: str | None = None) -> dict:
+    async def get_images(
+        self, namespace_id: str, name: str | None = None
+    ) -> list[dict]:
         """Get namespace images.
 
+        The response is cached for the lifetime of the instance.
+
         Args:
             namespace_id: Id of the namespace to list images from
             name: Image name to filter on. Defaults to None.
 
         Returns:
             Scaleway API response
-        """
-        params = {"namespace_id": namespace_id}
-        if name:
-            params["name"] = name
-        resp = await self.client.get(f"{self.base_url}/images", params=params)
-        return resp.json()["images"]
 
-    async def get_image_tags(self, image_id: str, max_pages: int = 20) -> list:
-        """Get tags for the provided image id.
+        Raises:
+            HTTPStatusError: The API returned an error
+        """
+        key = (namespace_id, name)
+        async with self._cache_locks[("images", key)]:
+            if key not in self._images_cache:
+                params = {"namespace_id": namespace_id}
+                if name:
+                    params["name"] = name
+                async with self._limiter:
+                    resp = await self.client.get(self._images_url, params=params)
+                resp.raise_for_status()
+                self._images_cache[key] = _json(resp)["images"]
+        return self._images_cache[key]
+
+    async def _get_tag_page(self, url: URL, page: int) -> _TagPage:
+        """Get a page of image tags.
 
         Args:
-            image_id: Id of the image to list tag from
-            max_pages: Maximum number of pages to retrieve when listing tags.
-                Defaults to 20.
+            url: Tag listing URL of the image
+            page: Page number, starting at 1
 
         Returns:
             Scaleway API response
+
+        Raises:
+            HTTPStatusError: The API returned an error
         """
-        page: int = 1
-        tags: list[ImageRef] = []
-        while page < max_pages:
+        async with self._limiter:
             resp = await self.client.get(
-                f"{self.base_url}/images/{image_id}/tags",
-                params={"page_size": 100, "page": page},
+                url, params={"page_size": PAGE_SIZE, "page": page}
             )
-            data = resp.json()
+        resp.raise_for_status()
+        return _TAG_PAGE_DECODER.decode(resp.content)
+
+    async def _task_get_tag_page(
+        self, pages: dict[int, list[Tag]], url: URL, page: int
+    ) -> None:
+        """An async task that stores a page of image tags in pages
+
+        Args:
+            pages: Shared dictionary on which tags will be added, by page number
+            url: Tag listing URL of the image
+            page: Page number, starting at 1
+        """
+        pages[page] = (await self._get_tag_page(url, page)).tags
+
+    async def _get_image_tag_pages(
+        self, image_id: str, max_pages: int | None = None
+    ) -> AsyncGenerator[list[Tag], None]:
+        """Iterate over tag pages of the provided image id.
+
+        When the first page reports `total_count`, the remaining pages are
+        fetched concurrently. Otherwise, pages are fetched one after the other
+        until the API returns a short page.
+
+        Args:
+            image_id: Id of the image to list tag from
+            max_pages: Maximum number of pages to retrieve when listing tags.
+                Defaults to None (no limit).
+
+        Yields:
+            Lists of tag API objects, in page order
+        """
+        # Parse the URL once, only the page parameter changes between requests
+        url = URL(f"{self._images_url}/{image_id}/tags")
+        data = await self._get_tag_page(url, 1)
+        yield data.tags
+        if len(data.tags) < PAGE_SIZE:
+            return
+
+        if data.total_count is not None:
+            last_page = ceil(data.total_count / PAGE_SIZE)
+            if max_pages is not None:
+                last_page = min(last_page, max_pages)
+            pages: dict[int, list[Tag]] = {}
+            async with create_task_group() as task_group:
+                for page in range(2, last_page + 1):
+                    task_group.start_soon(self._task_get_tag_page, pages, url, page)
+            for page in range(2, last_page + 1):
+                yield pages[page]
+            return
+
+        page = 2
+        while max_pages is None or page <= max_pages:
+            page_tags = (await self._get_tag_page(url, page)).tags
+            yield page_tags
+            if len(page_tags) < PAGE_SIZE:
+                break
             page += 1
-            tags.extend(data["tags"])
-        return tags
 
-    async def get_namespace_tags(self, namespace: str) -> dict[str, list[ImageRef]]:
-        """Filter all tags on the given namespace using the provided pattern.
+    async def get_image_tags(
+        self, image_id: str, max_pages: int | None = None
+    ) -> AsyncGenerator[Tag, None]:
+        """Iterate over tags of the provided image id.
+
+        Tags are yielded page by page, as soon as each page is received.
+
+        Args:
+            image_id: Id of the image to list tag from
+            max_pages: Maximum number of pages to retrieve when listing tags.
+                Defaults to None (no limit).
+
+        Yields:
+            Tag API objects
+        """
+        async for page_tags in self._get_image_tag_pages(image_id, max_pages):
+            for tag in page_tags:
+                yield tag
+
+    async def get_namespace_tags(
+        self, namespace: str, image_pattern: Pattern[str] | None = None
+    ) -> dict[str, list[ImageRef]]:
+        """Get all tags on the given namespace.
 
         Args:
-            namespace: Name of the namespace in which to filter tags
-            pattern: Regex pattern used to match tag names
+            namespace: Name of the namespace in which to get tags
+            image_pattern: Regex pattern that must match image names. Tags of
+                other images are not fetched. Defaults to None.
 
         Returns:
             A Mapping of image names to ImageRef list
         """
-        selected_tags: defaultdict[str, list[ImageRef]] = defaultdict(list)
-
         resp = await self.get_namespace(name=namespace)
         namespace_id = resp[0]["id"]
-        images = await self.get_images(namespace_id)
-        lock = Lock()
-        async with create_task_group() as task_group:
+        images = [
+            image
+            for image in await self.get_images(namespace_id)
+            if not image_pattern or image_pattern.match(image["name"])
+        ]
+        send_stream: MemoryObjectSendStream[tuple[str, list[ImageRef]]]
+        receive_stream: MemoryObjectReceiveStream[tuple[str, list[ImageRef]]]
+        send_stream, receive_stream = create_memory_object_stream(len(images))
+        async with create_task_group() as task_group, send_stream:
             for image in images:
                 task_group.start_soon(
                     self._task_get_tags,
-                    lock,
-                    selected_tags,
+                    send_stream.clone(),
                     namespace,
                     image,
                 )
 
-        return selected_tags
+        async with receive_stream:
+            return {name: image_refs async for name, image_refs in receive_stream}
+
+    async def _delete_tag(self, tag_id: str) -> Response:
+        """Delete the specified tag without decoding the response body
+
+        Args:
+            tag_id: Id of the tag to delete
+
+        Returns:
+            Scaleway API response
+
+        Raises:
+            HTTPStatusError: The API returned an error
+        """
+        async with self._limiter:
+            resp = await self.client.delete(f"{self._tags_url}/{tag_id}")
+        resp.raise_for_status()
+        logger.info("Deleted tag %s", tag_id)
+        return resp
 
     async def delete_tag(self, tag_id: str) -> dict:
         """Delete the specified tag
@@ -356,21 +610,45 @@ class RegistryAPI:
 
         Returns:
             Scaleway API response
+
+        Raises:
+            HTTPStatusError: The API returned an error
         """
-        resp = await self.client.delete(f"{self.base_url}/tags/{tag_id}")
-        logger.info("Deleted tag %s", tag_id)
-        return resp.json()
+        return _json(await self._delete_tag(tag_id))
+
+    async def _task_delete_tag(self, results: dict[str, bool], tag_id: str) -> None:
+        """An async task that deletes a tag and records the outcome in results
 
-    async def bulk_delete_tag(self, ids: list[str]) -> None:
+        Args:
+            results: Shared dictionary on which deletion outcome will be added
+            tag_id: Id of the tag to delete
+        """
+        try:
+            await self._delete_tag(tag_id)
+        except HTTPError as exc:
+            logger.error("Failed to delete tag %s: %s", tag_id, exc)
+            results[tag_id] = False
+        else:
+            results[tag_id] = True
+
+    async def bulk_delete_tag(self, ids: list[str]) -> dict[str, bool]:
         """Delete image tags in bulk
 
+        All deletions are scheduled at once, the number of in-flight
+        requests being bounded by `MAX_CONCURRENT_REQUESTS`. A failed deletion
+        does not cancel the other ones.
+
         Args:
             ids: Ids of the tags to delete
+
+        Returns:
+            A Mapping of tag ids to whether the tag has been deleted
         """
-        for batch in batched(ids, round(self._read_timout / 2)):
-            async with create_task_group() as task_group:
-                for tag_id in batch:
-                    task_group.start_soon(self.delete_tag, tag_id)
+        results: dict[str, bool] = {}
+        async with create_task_group() as task_group:
+            for tag_id in ids:
+                task_group.start_soon(self._task_delete_tag, results, tag_id)
+        return results
 
     async def get_old_tags(
         self,
@@ -379,38 +657,50 @@ class RegistryAPI:
         keep: int | None = None,
         pattern: Pattern[str] | None = None,
         exclude_statuses: Iterable[TagStatus] | None = None,
+        image_pattern: Pattern[str] | None = None,
     ) -> dict[str, list[ImageRef]]:
         """Get tag older then the specified age
 
         Args:
             namespace: Name of the namespace in which to get tags
-            grace: Minimal age tag age. Defaults to None.
-            keep: Minimal number of tags to keep per image. Defaults to None.
+            grace: Minimal age tag age. If None, every selected tag but the
+                `keep` newest ones is returned, whatever its age. Defaults to None.
+            keep: Number of newest selected tags to keep per image, counted
+                against all selected tags. Defaults to None.
             pattern: Regex pattern that must match tag names. Defaults to None.
+            exclude_statuses: Tag statuses that are never selected.
+                Defaults to None.
+            image_pattern: Regex pattern that must match image names.
+                Defaults to None.
 
         Returns:
             A Mapping of image names to ImageRef list
         """
-        selected_tags = await self.get_namespace_tags(namespace)
-        tags_to_delete: defaultdict[str, list[ImageRef]] = defaultdict(list)
-        keep_ = keep or float("-inf")
+        selected_tags = await self.get_namespace_tags(namespace, image_pattern)
+        tags_to_delete: dict[str, list[ImageRef]] = {}
+        keep_ = max(keep or 0, 0)
         exclude_statuses_ = set(exclude_statuses or ())
 
+        cutoff = None if grace is None else datetime.now(timezone.utc) - grace
+
         for image, tags in selected_tags.items():
-            tags.sort(key=lambda item: item.created_at)
-            tag_count: int = 0
-            to_delete: list[ImageRef] = []
-            now = datetime.now()
-            for tag in tags:
-                tag_count += 1
-                if (
-                    pattern and not pattern.match(tag.tag_name)
-                ) or tag.status in exclude_statuses_:
-                    continue
-                too_old = False
-                if grace:
-                    too_old = now - tag.created_at >= grace
-                if too_old and tag_count - len(to_delete) >= keep_:
-                    to_delete.append(tag)
-            tags_to_delete[image] = to_delete
+            selected = [
+                tag
+                for tag in tags
+                if (not pattern or pattern.match(tag.tag_name))
+                and tag.status not in exclude_statuses_
+            ]
+            if cutoff is not None:
+                candidates = [tag for tag in selected if tag.created_at <= cutoff]
+            else:
+                # Without grace duration, all but the keep_ newest tags are
+                # selected, however recent they are
+                candidates = selected if keep_ else []
+            # Ensure at least keep_ selected tags remain, deleting the oldest first
+            delete_count = min(len(candidates), len(selected) - keep_)
+            tags_to_delete[image] = (
+                nsmallest(delete_count, candidates, key=attrgetter("created_at"))
+                if delete_count > 0
+                else []
+            )
         return tags_to_delete
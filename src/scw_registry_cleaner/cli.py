@@ -8,18 +8,25 @@ import argparse
 import logging
 import os
 import re
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from typing import TYPE_CHECKING
 
 import anyio
-from anyio import create_task_group
+from anyio import create_task_group, to_thread
 from prettytable import PrettyTable
 
 from scw_registry_cleaner.api import RegistryAPI, TagStatus
 
+try:
+    import re2  # type: ignore[import]
+except ImportError:
+    re2 = None
+
 if TYPE_CHECKING:
     from re import Pattern
 
+    from scw_registry_cleaner.api import ImageRef
+
 
 logger = logging.getLogger(__name__)
 
@@ -54,7 +61,11 @@ parser.add_argument(
     metavar="NUMBER",
     type=int,
     nargs=1,
-    help="Minimum tags to keep outside of the grace duration",
+    help=(
+        "Number of most recent selected tags to keep in each image, whatever"
+        " their age. Without --grace, all selected tags but the NUMBER most"
+        " recent ones are deleted"
+    ),
     default=None,
 )
 parser.add_argument(
@@ -64,8 +75,10 @@ parser.add_argument(
     nargs=1,
     help=(
         "Delete any selected tags older than the specified duration"
-        " (in hours, minutes or seconds)."
-        " Valid examples: '48hr', '3600s', '24hr30m'"
+        " (in hours, minutes or seconds), still keeping the --keep most"
+        " recent selected tags."
+        " Valid examples: '48hr', '3600s', '24hr30m'."
+        " Without --grace, tags are only deleted if --keep is set"
     ),
 )
 parser.add_argument(
@@ -76,7 +89,22 @@ parser.add_argument(
     default=None,
     help=(
         "Filter tags for that can be selected for deletion."
-        " Any tag not matching the pattern will not be deleted"
+        " Any tag not matching the pattern will not be deleted."
+        " Uses RE2 syntax if the re2 extra is installed"
+        " (falling back to Python re for unsupported patterns),"
+        " Python re syntax otherwise"
+    ),
+)
+parser.add_argument(
+    "-i",
+    "--image-pattern",
+    metavar="REGEX",
+    nargs=1,
+    default=None,
+    help=(
+        "Filter images in which tags can be selected for deletion."
+        " Tags of images not matching the pattern are not fetched."
+        " Same syntax as --pattern"
     ),
 )
 parser.add_argument(
@@ -89,6 +117,61 @@ parser.add_argument(
 )
 
 TIMEDELTA_REGEX = r"((?P<hours>\d+?)hr)?((?P<minutes>\d+?)m)?((?P<seconds>\d+?)s)?"
+_TIMEDELTA_RE = re.compile(TIMEDELTA_REGEX)
+
+
+def compile_pattern(pattern: str) -> Pattern:
+    """Compile the tag name pattern.
+
+    The linear time RE2 engine is used if google-re2 is installed, so a
+    pathological pattern cannot stall tag filtering. Patterns relying on
+    features unsupported by RE2 (backreferences, lookarounds) fall back to `re`.
+    Both engines don't always agree on the same pattern (e.g. `\\d` only
+    matches ASCII digits and POSIX classes like `[[:alpha:]]` are supported
+    with RE2), so the engine in use is logged.
+
+    Args:
+        pattern: Regex pattern
+
+    Returns:
+        A compiled pattern
+    """
+    if re2 is not None:
+        options = re2.Options()
+        # Don't let re2 print parse errors to stderr, fallback is logged below
+        options.log_errors = False
+        try:
+            compiled = re2.compile(pattern, options=options)
+        except re2.error:
+            logger.debug("Pattern %s not supported by re2, using re", pattern)
+        else:
+            logger.info("Pattern %s compiled with re2", pattern)
+            return compiled
+    logger.info("Pattern %s compiled with re", pattern)
+    return re.compile(pattern)
+
+
+def build_summary_table(tags: dict[str, list[ImageRef]]) -> PrettyTable:
+    """Build a table summarizing the given tags.
+
+    Args:
+        tags: A Mapping of image names to ImageRef list
+
+    Returns:
+        A PrettyTable instance
+    """
+    table = PrettyTable(field_names=["Age", "Image ref"], align="l")
+    now = datetime.now(timezone.utc)
+
+    for name, image_tags in tags.items():
+        table.add_row([f"{name} image", ""], divider=True)
+
+        for i, tag in enumerate(image_tags):
+            days, hours = tag.age(now)
+            divider = i == len(image_tags) - 1
+            table.add_row([f"{days} days, {hours} hours", tag.ref], divider=divider)
+
+    return table
 
 
 async def delete_old_tags(
@@ -98,6 +181,7 @@ async def delete_old_tags(
     keep: int | None = None,
     pattern: Pattern | None = None,
     dry_run: bool = False,
+    image_pattern: Pattern | None = None,
 ) -> None:
     """Delete namespace tag older than the specified age.
 
@@ -109,6 +193,8 @@ async def delete_old_tags(
         pattern: Regex pattern that must match tag names. Defaults to None.
         dry_run: If True, print tags that would be deleted, but don't delete them.
             Defaults to False.
+        image_pattern: Regex pattern that must match image names.
+            Defaults to None.
     """
     tags_to_delete = await api.get_old_tags(
         namespace=namespace,
@@ -116,22 +202,28 @@ async def delete_old_tags(
         keep=keep,
         pattern=pattern,
         exclude_statuses=[TagStatus.DELETING],
+        image_pattern=image_pattern,
     )
 
-    table = PrettyTable(field_names=["Age", "Image ref"], align="l")
-    tag_ids: list[str] = []
-
-    for name, tags in tags_to_delete.items():
-        table.add_row([f"{name} image", ""], divider=True)
-
-        for i, tag in enumerate(tags):
-            tag_ids.append(tag.tag_id)
-            days, hours = tag.age()
-            divider = i == len(tags) - 1
-            table.add_row([f"{days} days, {hours} hours", tag.ref], divider=divider)
-
     if not dry_run:
-        await api.bulk_delete_tag(tag_ids)
+        tag_ids = [tag.tag_id for tags in tags_to_delete.values() for tag in tags]
+        results = await api.bulk_delete_tag(tag_ids)
+
+        if failed := [tag_id for tag_id, deleted in results.items() if not deleted]:
+            logger.error(
+                "Failed to delete %s tags in %s namespace: %s",
+                len(failed),
+                namespace,
+                ", ".join(failed),
+            )
+        # Only summarize tags that were actually deleted
+        tags_to_delete = {
+            name: [tag for tag in tags if results.get(tag.tag_id)]
+            for name, tags in tags_to_delete.items()
+        }
+
+    # Format the summary in a worker thread to keep the event loop responsive
+    table = await to_thread.run_sync(build_summary_table, tags_to_delete)
 
     title = "Tags that would be deleted" if dry_run else "Deleted tags"
     print(f"\n{title}:\n")
@@ -146,7 +238,7 @@ async def delete_old_namesapces_tags(
     keep: int | None = None,
     pattern: Pattern | None = None,
     dry_run: bool = False,
-    debug: bool = False,
+    image_pattern: Pattern | None = None,
 ) -> None:
     """Delete tags in the specified namespaces
         older than the specified age
@@ -159,12 +251,21 @@ async def delete_old_namesapces_tags(
         pattern: Regex pattern that must match tag names. Defaults to None.
         dry_run: If True, print tags that would be deleted, but don't delete them.
             Defaults to False.
+        image_pattern: Regex pattern that must match image names.
+            Defaults to None.
     """
-    async with RegistryAPI(token=token, debug=debug, region=region) as api:
+    async with RegistryAPI(token=token, region=region) as api:
         async with create_task_group() as task_group:
             for namespace in namespaces:
                 task_group.start_soon(
-                    delete_old_tags, api, namespace, grace, keep, pattern, dry_run
+                    delete_old_tags,
+                    api,
+                    namespace,
+                    grace,
+                    keep,
+                    pattern,
+                    dry_run,
+                    image_pattern,
                 )
 
 
@@ -179,26 +280,33 @@ def main() -> None:
     keep_arg: list[int] | None = args.keep
     grace_arg: list[str] = args.grace
     pattern_arg: list[str] | None = args.pattern
+    image_pattern_arg: list[str] | None = args.image_pattern
     dry_run: bool = args.dry_run
 
+    logging.basicConfig(format="%(levelname)s: %(message)s")
+    if args.debug:
+        logging.getLogger("scw_registry_cleaner").setLevel(logging.DEBUG)
+
     if args.scw_secret_key is not None:
         api_token = args.scw_secret_key[0]
     if args.region is not None:
         region = args.region[0]
 
-    keep = float("-inf") if keep_arg is None else keep_arg[0]
-    grace, pattern = None, None
+    keep = None if keep_arg is None else keep_arg[0]
+    grace, pattern, image_pattern = None, None, None
 
     if grace_arg:
-        match = re.match(TIMEDELTA_REGEX, grace_arg[0])
-        if not match:
-            raise ValueError(f"Invalid duration expression {grace_arg[0]}")
-        groups = match.groupdict()
+        match = _TIMEDELTA_RE.fullmatch(grace_arg[0])
+        groups = match.groupdict() if match else {}
         time_params = {name: int(param) for name, param in groups.items() if param}
+        if not time_params:
+            raise ValueError(f"Invalid duration expression {grace_arg[0]}")
         grace = timedelta(**time_params)
 
     if pattern_arg is not None:
-        pattern = re.compile(pattern_arg[0])
+        pattern = compile_pattern(pattern_arg[0])
+    if image_pattern_arg is not None:
+        image_pattern = compile_pattern(image_pattern_arg[0])
 
     anyio.run(
         delete_old_namesapces_tags,
@@ -209,7 +317,10 @@ def main() -> None:
         keep,
         pattern,
         dry_run,
-        args.debug,
+        image_pattern,
+        backend="asyncio",
+        # anyio silently keeps the default event loop if uvloop is not installed
+        backend_options={"use_uvloop": True},
     )
 
 